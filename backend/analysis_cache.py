@@ -0,0 +1,83 @@
+"""Cache for video probe/analysis results keyed by file content"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class AnalysisCache:
+    """Store analysis results on disk with a small in-memory LRU in front"""
+    
+    # Bump whenever the shape of the stored results changes; entries written
+    # by older versions are then ignored and eventually swept
+    SCHEMA_VERSION = 2
+    
+    def __init__(self, cache_dir: Path, max_entries: int = 128):
+        """
+        Args:
+            cache_dir: Directory holding one JSON file per content hash
+            max_entries: How many results to keep in memory
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, content_hash: str) -> Optional[Dict]:
+        """
+        Look up cached results for a content hash
+        
+        Returns:
+            The cached dict, or None if this content hasn't been analyzed
+        """
+        with self._lock:
+            if content_hash in self._memory:
+                self._memory.move_to_end(content_hash)
+                return self._memory[content_hash]
+        
+        cache_file = self._path(content_hash)
+        try:
+            with open(cache_file, "r") as f:
+                data = json.load(f)
+            # Keep entries that are still being used from being swept
+            os.utime(cache_file)
+        except (OSError, ValueError):
+            return None
+        
+        self._remember(content_hash, data)
+        return data
+    
+    def set(self, content_hash: str, data: Dict):
+        """Save results for a content hash (atomic on disk)"""
+        cache_file = self._path(content_hash)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+        
+        self._remember(content_hash, data)
+    
+    def sweep(self, max_age: float):
+        """Delete cache files (including other versions and stray temp files) unused for max_age seconds"""
+        cutoff = time.time() - max_age
+        for path in self.cache_dir.iterdir():
+            try:
+                if path.is_file() and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass  # Replaced or removed concurrently
+    
+    def _path(self, content_hash: str) -> Path:
+        """On-disk location of the entry for a content hash"""
+        return self.cache_dir / f"v{self.SCHEMA_VERSION}-{content_hash}.json"
+    
+    def _remember(self, content_hash: str, data: Dict):
+        """Add an entry to the in-memory LRU, evicting the oldest if full"""
+        with self._lock:
+            self._memory[content_hash] = data
+            self._memory.move_to_end(content_hash)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
@@ -6,15 +6,31 @@ from pathlib import Path
 BASE_DIR = Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 OUTPUT_DIR = BASE_DIR / "output"
+ANALYSIS_CACHE_DIR = OUTPUT_DIR / ".cache"
 
 # Create directories if they don't exist
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
+ANALYSIS_CACHE_DIR.mkdir(exist_ok=True)
 
 # File settings
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100 MB
+MULTIPART_OVERHEAD = 1024 * 1024  # Headroom for form fields and boundaries
+# Largest acceptable /process-reel body: video + optional reference file
+MAX_REQUEST_SIZE = 2 * MAX_FILE_SIZE + MULTIPART_OVERHEAD
 ALLOWED_VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv"}
 
+# Cleanup settings
+# Job files left behind (e.g. after a dropped download) are removed after this many seconds
+FILE_TTL_SECONDS = int(os.getenv("FILE_TTL_SECONDS", "3600"))
+SWEEP_INTERVAL_SECONDS = 600
+# Cached video analysis results unused for this many seconds are removed
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Concurrency settings
+# Caps how many blocking jobs (ffmpeg, analysis, music generation) run at once
+MAX_WORKER_THREADS = int(os.getenv("MAX_WORKER_THREADS", "8"))
+
 # Music generation settings
 # You'll need to get a free API key from https://mubert.com/render/api
 MUBERT_LICENSE = os.getenv("MUBERT_LICENSE", "")  # Get from environment variable
@@ -1,19 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Header
-from fastapi.responses import FileResponse, HTMLResponse
+import os
+
+# Keep OpenMP/BLAS users such as NumPy single-threaded; OpenCV's own thread
+# pool does the parallel work in video analysis. This has to run before
+# anything below imports numpy.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Header, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-import os
+from starlette.background import BackgroundTask
+import asyncio
+import json
+import time
 import uuid
 from pathlib import Path
-from typing import Optional
-import shutil
+from typing import Dict, Optional, Tuple
 from enum import Enum
 import zipfile
 import secrets
 import hashlib
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
 
-from config import UPLOAD_DIR, OUTPUT_DIR, ALLOWED_VIDEO_EXTENSIONS, MAX_FILE_SIZE
+import aiofiles
+import anyio
+
+from config import (
+    UPLOAD_DIR, OUTPUT_DIR, ANALYSIS_CACHE_DIR, ALLOWED_VIDEO_EXTENSIONS, MAX_FILE_SIZE, MAX_REQUEST_SIZE,
+    MAX_WORKER_THREADS,
+    FILE_TTL_SECONDS, SWEEP_INTERVAL_SECONDS, ANALYSIS_CACHE_TTL_SECONDS
+)
+from analysis_cache import AnalysisCache
 from video_processor import VideoProcessor
 from music_generator import MusicGenerator
 from video_analyzer import VideoAnalyzer
@@ -43,12 +62,62 @@ class MusicStyle(str, Enum):
     rock = "rock"
 
 
+def sweep_stale_files(max_age: float):
+    """Delete job files in the upload/output directories older than max_age seconds"""
+    cutoff = time.time() - max_age
+    for directory in (UPLOAD_DIR, OUTPUT_DIR):
+        for path in directory.iterdir():
+            # Skip .gitkeep and the analysis cache directory
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass  # Already removed by its own request
+
+
+async def sweep_periodically():
+    """Background loop that keeps the upload/output directories and analysis cache bounded"""
+    while True:
+        try:
+            await anyio.to_thread.run_sync(sweep_stale_files, FILE_TTL_SECONDS)
+            await anyio.to_thread.run_sync(analysis_cache.sweep, ANALYSIS_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"⚠️  Cleanup sweep failed: {e}")
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up shared resources on startup"""
+    # Dedicated limiter so heavy jobs can't starve the default threadpool,
+    # which still runs sync dependencies (auth, generator lookup), upload
+    # reads and FileResponse streaming
+    app.state.worker_limiter = anyio.CapacityLimiter(MAX_WORKER_THREADS)
+    # Read the frontend once instead of on every request to /
+    html_file = frontend_path / "index.html"
+    app.state.index_html = html_file.read_bytes() if html_file.exists() else None
+    sweeper = asyncio.create_task(sweep_periodically())
+    yield
+    sweeper.cancel()
+
+
 app = FastAPI(
     title="Reel Music Generator",
     description="Upload a video reel and get it back with AI-generated royalty-free music",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in a worker thread so the event loop stays responsive"""
+    return await anyio.to_thread.run_sync(
+        partial(func, *args, **kwargs),
+        limiter=app.state.worker_limiter
+    )
+
 # Authentication setup
 security = HTTPBasic()
 APP_PASSWORD = os.getenv("APP_PASSWORD", "sam")  # Default password, change via env var
@@ -68,6 +137,18 @@ def verify_password(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials.username
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from Content-Length before the body is read"""
+    if request.method == "POST" and request.url.path == "/process-reel":
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_REQUEST_SIZE:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.0f}MB"}
+            )
+    return await call_next(request)
+
 # Enable CORS for frontend access
 app.add_middleware(
     CORSMiddleware,
@@ -83,38 +164,132 @@ if frontend_path.exists():
     app.mount("/static", StaticFiles(directory=str(frontend_path)), name="static")
 
 
+# Static JSON responses, serialized once at import
+_ROOT_BYTES = json.dumps({"status": "ok", "message": "Reel Music Generator API is running"}).encode()
+_HEALTH_BYTES = json.dumps({
+    "status": "ok",
+    "message": "Reel Music Generator API is running",
+    "version": "1.0.0"
+}).encode()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the frontend HTML"""
-    html_file = frontend_path / "index.html"
-    if html_file.exists():
-        return HTMLResponse(content=html_file.read_text(), status_code=200)
-    return {"status": "ok", "message": "Reel Music Generator API is running"}
+    if app.state.index_html is not None:
+        return HTMLResponse(content=app.state.index_html, status_code=200)
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 
 @app.get("/health")
-def health():
+async def health():
     """Health check endpoint"""
-    return {
-        "status": "ok",
-        "message": "Reel Music Generator API is running",
-        "version": "1.0.0"
-    }
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 
 # Initialize services
 video_processor = VideoProcessor()
-music_generator = MusicGenerator()
 video_analyzer = VideoAnalyzer()
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_DIR)
+
+
+@lru_cache(maxsize=None)
+def get_music_generator() -> MusicGenerator:
+    """Create the music generator on first use and share it across requests"""
+    return MusicGenerator()
+
+
+_STYLES_BYTES = json.dumps({
+    "styles": MusicGenerator.get_available_styles(),
+    "description": "Choose a style that matches your video mood"
+}).encode()
 
 
 @app.get("/styles")
-def get_music_styles():
+async def get_music_styles():
     """Get available music styles"""
-    return {
-        "styles": music_generator.get_available_styles(),
-        "description": "Choose a style that matches your video mood"
+    return Response(content=_STYLES_BYTES, media_type="application/json")
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+async def save_upload(upload: UploadFile, destination: Path, max_size: Optional[int] = None) -> str:
+    """
+    Stream an uploaded file to disk in fixed-size chunks, hashing it on the way
+
+    Args:
+        upload: The incoming upload
+        destination: Where to write the file
+        max_size: Optional size limit in bytes; the partial file is removed if exceeded
+
+    Returns:
+        Hex BLAKE2b digest of the file contents
+    """
+    total = 0
+    hasher = hashlib.blake2b(digest_size=16)
+    try:
+        async with aiofiles.open(destination, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if max_size is not None and total > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum size: {max_size / (1024*1024):.0f}MB"
+                    )
+                hasher.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        if destination.exists():
+            os.remove(destination)
+        raise
+    return hasher.hexdigest()
+
+
+def analyze_upload(video_path: str, content_hash: str) -> Dict:
+    """
+    Probe and analyze a video, reusing results for previously seen content
+    
+    Returns:
+        Dict with "duration" and "video_analysis"
+    """
+    cached = analysis_cache.get(content_hash)
+    if cached:
+        print("♻️  Reusing cached video analysis")
+        return cached
+    
+    result = {
+        "duration": video_processor.get_video_duration(video_path),
+        "video_analysis": video_analyzer.analyze_video_dynamics(video_path)
     }
+    analysis_cache.set(content_hash, result)
+    return result
+
+
+def merge_outputs(video_path: Path, music_path: Path, output_path: Path, remove_original_audio: bool) -> Tuple[os.stat_result, os.stat_result]:
+    """
+    Merge the music into the video
+    
+    Returns:
+        stat results for the final video and the music file, taken on the
+        worker thread so FileResponse doesn't have to stat them again
+    """
+    video_processor.merge_audio_video(
+        video_path=str(video_path),
+        audio_path=str(music_path),
+        output_path=str(output_path),
+        remove_original_audio=remove_original_audio
+    )
+    return os.stat(output_path), os.stat(music_path)
+
+
+def build_package(zip_path: Path, video_path: Path, video_name: str, audio_path: Path, audio_name: str) -> os.stat_result:
+    """Bundle the final video and music into a single ZIP file and return its stat result"""
+    # MP4 is already compressed, so store it as-is; only the PCM WAV benefits from deflate
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+        zipf.write(video_path, video_name)
+        zipf.write(audio_path, audio_name, compress_type=zipfile.ZIP_DEFLATED)
+    return os.stat(zip_path)
 
 
 @app.post("/process-reel")
@@ -124,7 +299,8 @@ async def process_reel(
     remove_original_audio: bool = Form(True, description="Remove original audio from video"),
     reference_audio: Optional[UploadFile] = File(None, description="Optional: Upload a song OR video with music for AI to use as inspiration (MP3, WAV, MP4, MOV)"),
     output_format: OutputFormat = Form(OutputFormat.video, description="Download format: video (video with music), audio (music only), or both (ZIP file)"),
-    username: str = Depends(verify_password)
+    username: str = Depends(verify_password),
+    music_generator: MusicGenerator = Depends(get_music_generator)
 ):
     """
     Upload a video reel and get it back with AI-generated music
@@ -148,7 +324,7 @@ async def process_reel(
     style_str = style.value
     
     # Generate unique ID for this processing job
-    job_id = str(uuid.uuid4())
+    job_id = uuid.uuid4().hex
     
     # Create paths
     upload_path = UPLOAD_DIR / f"{job_id}_{video.filename}"
@@ -161,42 +337,32 @@ async def process_reel(
         reference_path = UPLOAD_DIR / f"{job_id}_reference_{reference_audio.filename}"
     
     try:
-        # Save uploaded video
-        with open(upload_path, "wb") as buffer:
-            shutil.copyfileobj(video.file, buffer)
+        # Save uploaded video (size limit enforced while streaming)
+        content_hash = await save_upload(video, upload_path, max_size=MAX_FILE_SIZE)
         
         # Save reference audio/video if provided
         if reference_audio and reference_path:
-            with open(reference_path, "wb") as buffer:
-                shutil.copyfileobj(reference_audio.file, buffer)
+            await save_upload(reference_audio, reference_path, max_size=MAX_FILE_SIZE)
             
             # Check if reference is a video - extract audio from it
             ref_ext = Path(reference_audio.filename).suffix.lower()
             if ref_ext in ALLOWED_VIDEO_EXTENSIONS:
                 print(f"🎬 Reference video uploaded: {reference_audio.filename}")
                 print(f"🎵 Extracting audio from reference video...")
-                reference_audio_path = UPLOAD_DIR / f"{job_id}_reference_audio.wav"
-                video_processor.extract_audio(str(reference_path), str(reference_audio_path))
+                reference_audio_path = UPLOAD_DIR / f"{job_id}_reference_audio.mp3"
+                reference_audio_path = Path(await run_blocking(
+                    video_processor.extract_audio, str(reference_path), str(reference_audio_path)
+                ))
                 print(f"✅ Audio extracted from video")
             else:
                 print(f"📀 Reference audio uploaded: {reference_audio.filename}")
                 reference_audio_path = reference_path
         
-        # Check file size
-        file_size = os.path.getsize(upload_path)
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.0f}MB"
-            )
-        
-        # Get video information
-        video_info = video_processor.get_video_info(str(upload_path))
-        duration = int(video_info["duration"]) + 1  # Add 1 second buffer
-        
-        # Analyze video for transitions and pacing
+        # Get video information and analyze for transitions and pacing
         print("Analyzing video dynamics...")
-        video_analysis = video_analyzer.analyze_video_dynamics(str(upload_path))
+        analysis = await run_blocking(analyze_upload, str(upload_path), content_hash)
+        video_analysis = analysis["video_analysis"]
+        duration = int(analysis["duration"]) + 1  # Add 1 second buffer
         
         # Create intelligent music prompt based on video
         music_prompt = video_analyzer.get_music_prompt(video_analysis, style_str)
@@ -207,7 +373,8 @@ async def process_reel(
         print(f"Generating {style_str} music for {duration} seconds...")
         print(f"Using prompt: {music_prompt}")
         try:
-            music_generator.generate_music(
+            await run_blocking(
+                music_generator.generate_music,
                 duration=duration,
                 style=style_str,
                 prompt=music_prompt,
@@ -222,10 +389,11 @@ async def process_reel(
         
         # Merge video with generated music
         print("Merging video with music...")
-        video_processor.merge_audio_video(
-            video_path=str(upload_path),
-            audio_path=str(music_path),
-            output_path=str(output_path),
+        output_stat, music_stat = await run_blocking(
+            merge_outputs,
+            video_path=upload_path,
+            music_path=music_path,
+            output_path=output_path,
             remove_original_audio=remove_original_audio
         )
         
@@ -246,7 +414,9 @@ async def process_reel(
                 filename=f"reel_with_music_{video.filename}",
                 headers={
                     "Content-Disposition": f"attachment; filename=reel_with_music_{video.filename}"
-                }
+                },
+                stat_result=output_stat,
+                background=BackgroundTask(os.remove, output_path)
             )
         
         elif output_format == OutputFormat.audio:
@@ -258,15 +428,22 @@ async def process_reel(
                 filename=f"reel_music_{Path(video.filename).stem}.wav",
                 headers={
                     "Content-Disposition": f"attachment; filename=reel_music_{Path(video.filename).stem}.wav"
-                }
+                },
+                stat_result=music_stat,
+                background=BackgroundTask(os.remove, music_path)
             )
         
         else:  # OutputFormat.both
             # Create ZIP file with both video and audio
             zip_path = OUTPUT_DIR / f"{job_id}_package.zip"
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(output_path, f"reel_with_music_{video.filename}")
-                zipf.write(music_path, f"reel_music_{Path(video.filename).stem}.wav")
+            zip_stat = await run_blocking(
+                build_package,
+                zip_path,
+                video_path=output_path,
+                video_name=f"reel_with_music_{video.filename}",
+                audio_path=music_path,
+                audio_name=f"reel_music_{Path(video.filename).stem}.wav"
+            )
             
             # Clean up individual files
             os.remove(output_path)
@@ -278,11 +455,16 @@ async def process_reel(
                 filename=f"reel_package_{Path(video.filename).stem}.zip",
                 headers={
                     "Content-Disposition": f"attachment; filename=reel_package_{Path(video.filename).stem}.zip"
-                }
+                },
+                stat_result=zip_stat,
+                background=BackgroundTask(os.remove, zip_path)
             )
         
     except HTTPException:
-        # Re-raise HTTP exceptions
+        # Clean up files, then re-raise
+        for path in [upload_path, music_path, output_path, reference_path, reference_audio_path]:
+            if path and path.exists():
+                os.remove(path)
         raise
     except Exception as e:
         # Clean up files on error
@@ -297,20 +479,23 @@ async def process_reel(
         )
 
 
+_INFO_BYTES = json.dumps({
+    "name": "Reel Music Generator",
+    "description": "Upload Instagram reels and get them back with AI-generated royalty-free music",
+    "features": [
+        "AI-generated instrumental music",
+        "Royalty-free and commercially usable",
+        "Multiple music styles available",
+        "Automatic video-audio synchronization",
+        "No watermarks or limitations"
+    ],
+    "supported_formats": list(ALLOWED_VIDEO_EXTENSIONS),
+    "max_file_size_mb": MAX_FILE_SIZE / (1024 * 1024),
+    "music_styles": MusicGenerator.get_available_styles()
+}).encode()
+
+
 @app.get("/info")
-def get_info():
+async def get_info():
     """Get information about the service"""
-    return {
-        "name": "Reel Music Generator",
-        "description": "Upload Instagram reels and get them back with AI-generated royalty-free music",
-        "features": [
-            "AI-generated instrumental music",
-            "Royalty-free and commercially usable",
-            "Multiple music styles available",
-            "Automatic video-audio synchronization",
-            "No watermarks or limitations"
-        ],
-        "supported_formats": list(ALLOWED_VIDEO_EXTENSIONS),
-        "max_file_size_mb": MAX_FILE_SIZE / (1024 * 1024),
-        "music_styles": music_generator.get_available_styles()
-    }
\ No newline at end of file
+    return Response(content=_INFO_BYTES, media_type="application/json")
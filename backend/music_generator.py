@@ -1,9 +1,9 @@
 """Professional AI Music Generation using Real AI Services"""
 import os
-import requests
+import httpx
 import time
-from typing import Optional
-import replicate
+from functools import lru_cache
+from typing import Dict, Final, Optional
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -11,14 +11,52 @@ from pathlib import Path
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Detailed MusicGen prompts per style
+_PROMPTS: Final[Dict[str, str]] = {
+    "energetic": "upbeat electronic dance music, driving beat, energetic synths, modern EDM production, festival vibes, high energy, 128 BPM",
+
+    "epic": "epic cinematic orchestral music, powerful dramatic strings, heroic brass section, thundering percussion, movie trailer style, inspiring and grandiose",
+
+    "ambient": "ambient atmospheric soundscape, ethereal pads, gentle piano, calming textures, meditation music, peaceful and serene, floating melodies",
+
+    "happy": "happy upbeat pop music, bright cheerful melody, acoustic guitars, clapping rhythm, feel-good vibes, sunny and optimistic, major key",
+
+    "chill": "chill lofi hip hop beat, jazzy chords, vinyl crackle, mellow drums, lazy sunday afternoon, relaxed and smooth, 85 BPM",
+
+    "dramatic": "dark dramatic music, intense strings, ominous bass, suspenseful atmosphere, thriller soundtrack, minor key, building tension",
+
+    "upbeat": "upbeat dance pop, catchy melody, four on the floor beat, disco vibes, party anthem, energetic and fun, radio ready",
+
+    "inspiring": "inspiring motivational music, uplifting piano, soaring strings, hopeful melody, achievement and success, emotional build up, major key",
+
+    "cinematic": "cinematic film score, sweeping orchestra, emotional strings, grand piano, movie soundtrack, epic and beautiful, professional production",
+
+    "electronic": "modern electronic music, pulsing synth bass, digital drums, futuristic sound design, club banger, energetic drops, progressive house",
+
+    "hip-hop": "hip hop instrumental beat, 808 bass, trap drums, rolling hi hats, dark melody, modern rap beat, hard hitting, 140 BPM",
+
+    "lofi": "lofi beats to study to, jazzy samples, dusty drums, warm vinyl sound, relaxing hip hop, chill vibes, perfect loop, 70 BPM",
+
+    "rock": "energetic rock music, electric guitars, driving bass, powerful drums, anthemic chorus, stadium rock energy, distorted guitars"
+}
+
+# Styles in display order, shared by every caller
+_STYLES = tuple(_PROMPTS.keys())
+
+# MIME types for reference audio uploads, by file extension
+_MIME: Final[Dict[str, str]] = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "m4a": "audio/mp4",
+    "ogg": "audio/ogg"
+}
+
 
 class MusicGenerator:
     """Generate professional royalty-free music using real AI"""
     
     def __init__(self):
         """Initialize with API keys from environment"""
-        # Reload .env to ensure we get latest values
-        load_dotenv(override=True)
         self.replicate_key = os.getenv("REPLICATE_API_TOKEN", "")
         
         # Debug: Print if key is loaded (first 10 chars only)
@@ -27,6 +65,15 @@ class MusicGenerator:
         else:
             print("✗ No Replicate API key found. Set REPLICATE_API_TOKEN environment variable.")
         
+        # One keep-alive pool shared by every Replicate and Mubert call.
+        # Auth is sent per request so the token never reaches other hosts.
+        self._http = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(30.0, read=60.0),
+            limits=httpx.Limits(max_keepalive_connections=8)
+        )
+        self._replicate_headers = {"Authorization": f"Token {self.replicate_key}"}
+        
     def generate_music(
         self,
         duration: int,
@@ -106,35 +153,21 @@ class MusicGenerator:
             "normalization_strategy": "loudness"
         }
         
-        # If reference audio provided, convert to base64 and add
+        # If reference audio provided, upload it and pass the file URL
         if reference_audio:
-            import base64
-            with open(reference_audio, 'rb') as f:
-                audio_data = f.read()
-                audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-                
-                # Determine format from file extension
-                ext = reference_audio.split('.')[-1].lower()
-                mime_type = f"audio/{ext if ext in ['wav', 'mp3'] else 'mpeg'}"
-                
-                input_data["melody"] = f"data:{mime_type};base64,{audio_b64}"
-                print(f"   🎼 Reference audio included for melody conditioning")
+            input_data["melody"] = self._upload_reference_audio(reference_audio)
+            print(f"   🎼 Reference audio included for melody conditioning")
         
         # Use direct API calls
         url = "https://api.replicate.com/v1/predictions"
         
-        headers = {
-            "Authorization": f"Token {self.replicate_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "version": "671ac645ce5e552cc63a54a2bbff63fcf798043055d2dac5fc9e36a837eedcfb",
             "input": input_data
         }
         
         # Start the prediction
-        response = requests.post(url, json=data, headers=headers, timeout=30)
+        response = self._http.post(url, json=data, headers=self._replicate_headers, timeout=30)
         response.raise_for_status()
         
         prediction = response.json()
@@ -142,16 +175,17 @@ class MusicGenerator:
         
         print(f"   ⏳ Prediction started: {prediction_id}")
         
-        # Poll for completion
+        # Poll for completion, backing off from 0.5s up to 10s between checks
         get_url = f"https://api.replicate.com/v1/predictions/{prediction_id}"
         max_wait = 120  # 2 minutes max
-        waited = 0
+        started = time.monotonic()
+        attempt = 0
         
-        while waited < max_wait:
-            time.sleep(3)
-            waited += 3
+        while time.monotonic() - started < max_wait:
+            time.sleep(min(10.0, 0.5 * (1.5 ** attempt)))
+            attempt += 1
             
-            status_response = requests.get(get_url, headers=headers, timeout=30)
+            status_response = self._http.get(get_url, headers=self._replicate_headers, timeout=30)
             status_response.raise_for_status()
             result = status_response.json()
             
@@ -164,11 +198,7 @@ class MusicGenerator:
                     audio_url = audio_url[0]
                 
                 print("   ⬇️  Downloading generated audio...")
-                audio_response = requests.get(audio_url, timeout=60)
-                audio_response.raise_for_status()
-                
-                with open(output_path, 'wb') as f:
-                    f.write(audio_response.content)
+                self._download(audio_url, output_path, timeout=60)
                 
                 # If duration > 30s, extend it
                 if duration > 30:
@@ -183,10 +213,43 @@ class MusicGenerator:
                 raise Exception(f"MusicGen failed: {error}")
             
             # Still processing...
-            print(f"   ⏳ Generating... ({waited}s)")
+            print(f"   ⏳ Generating... ({time.monotonic() - started:.0f}s)")
         
         raise Exception("MusicGen timed out")
     
+    def _upload_reference_audio(self, reference_audio: str) -> str:
+        """
+        Upload a reference song to Replicate's file storage
+        
+        The file is streamed from disk instead of being inlined as base64,
+        which keeps the prediction request small.
+        
+        Returns:
+            URL of the uploaded file, usable as a model input
+        """
+        # Determine format from file extension
+        ext = Path(reference_audio).suffix.lstrip('.').lower()
+        mime_type = _MIME.get(ext, "audio/mpeg")
+        
+        with open(reference_audio, 'rb') as f:
+            response = self._http.post(
+                "https://api.replicate.com/v1/files",
+                files={"content": (Path(reference_audio).name, f, mime_type)},
+                headers=self._replicate_headers,
+                timeout=120
+            )
+        response.raise_for_status()
+        
+        return response.json()["urls"]["get"]
+    
+    def _download(self, url: str, output_path: str, timeout: int):
+        """Stream a remote file to disk without holding it all in memory"""
+        with self._http.stream("GET", url, timeout=timeout, follow_redirects=True) as response:
+            response.raise_for_status()
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_bytes(chunk_size=1 << 20):
+                    f.write(chunk)
+    
     def _generate_with_mubert(self, duration: int, style: str, output_path: str) -> str:
         """
         Generate using Mubert API (free tier available)
@@ -227,7 +290,7 @@ class MusicGenerator:
         print(f"   Requesting: {tags}")
         
         try:
-            response = requests.post(url, json=payload, timeout=60)
+            response = self._http.post(url, json=payload, timeout=60)
             
             if response.status_code == 200:
                 data = response.json()
@@ -249,11 +312,7 @@ class MusicGenerator:
                         print(f"   ⬇️  Downloading from Mubert...")
                         
                         # Download the audio
-                        audio_response = requests.get(download_url, timeout=90)
-                        audio_response.raise_for_status()
-                        
-                        with open(output_path, 'wb') as f:
-                            f.write(audio_response.content)
+                        self._download(download_url, output_path, timeout=90)
                         
                         # Extend if needed
                         if duration > 60:
@@ -274,76 +333,54 @@ class MusicGenerator:
         Extend audio file by crossfading copies
         """
         try:
-            from pydub import AudioSegment
-            
-            audio = AudioSegment.from_wav(audio_path)
-            current_duration = len(audio) / 1000.0  # Convert to seconds
-            
-            if current_duration >= target_duration:
-                return
-            
-            # Calculate how many times to repeat
-            repeats = int(target_duration / current_duration) + 1
-            
-            # Create extended version with crossfades
-            extended = audio
-            crossfade_ms = 2000  # 2 second crossfade
-            
-            for _ in range(repeats - 1):
-                extended = extended.append(audio, crossfade=crossfade_ms)
-                if len(extended) / 1000.0 >= target_duration:
-                    break
-            
-            # Trim to exact duration
-            extended = extended[:target_duration * 1000]
-            
-            # Export
-            extended.export(audio_path, format="wav")
-            
+            import numpy as np
+            import soundfile as sf
         except ImportError:
-            print("   ⚠️  pydub not available for audio extension")
+            print("   ⚠️  numpy/soundfile not available for audio extension")
+            return
+        
+        data, sample_rate = sf.read(audio_path, dtype='float32')
+        current_len = data.shape[0]
+        target_len = int(target_duration * sample_rate)
+        
+        if current_len == 0 or current_len >= target_len:
+            return
+        
+        # 2 second crossfade (shortened for very short clips)
+        crossfade = min(2 * sample_rate, current_len // 2)
+        fade_in = np.linspace(0.0, 1.0, crossfade, dtype=np.float32)
+        if data.ndim > 1:
+            fade_in = fade_in[:, np.newaxis]  # Broadcast across channels
+        fade_out = 1.0 - fade_in
+        
+        # Allocate the final buffer once and lay copies into it
+        extended = np.empty((target_len,) + data.shape[1:], dtype=np.float32)
+        extended[:current_len] = data
+        cursor = current_len
+        
+        while cursor < target_len:
+            # Blend the tail of the previous copy with the head of the next one
+            overlap = extended[cursor - crossfade:cursor]
+            overlap *= fade_out
+            overlap += data[:crossfade] * fade_in
+            
+            # Copy the rest of the clip, trimmed to the exact duration
+            count = min(current_len - crossfade, target_len - cursor)
+            extended[cursor:cursor + count] = data[crossfade:crossfade + count]
+            cursor += count
+        
+        sf.write(audio_path, extended, sample_rate, subtype='PCM_16')
     
-    def _create_detailed_prompt(self, style: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _create_detailed_prompt(style: str) -> str:
         """
         Create professional prompts that work well with MusicGen
         Based on what actually generates good music
         """
-        
-        prompts = {
-            "energetic": "upbeat electronic dance music, driving beat, energetic synths, modern EDM production, festival vibes, high energy, 128 BPM",
-            
-            "epic": "epic cinematic orchestral music, powerful dramatic strings, heroic brass section, thundering percussion, movie trailer style, inspiring and grandiose",
-            
-            "ambient": "ambient atmospheric soundscape, ethereal pads, gentle piano, calming textures, meditation music, peaceful and serene, floating melodies",
-            
-            "happy": "happy upbeat pop music, bright cheerful melody, acoustic guitars, clapping rhythm, feel-good vibes, sunny and optimistic, major key",
-            
-            "chill": "chill lofi hip hop beat, jazzy chords, vinyl crackle, mellow drums, lazy sunday afternoon, relaxed and smooth, 85 BPM",
-            
-            "dramatic": "dark dramatic music, intense strings, ominous bass, suspenseful atmosphere, thriller soundtrack, minor key, building tension",
-            
-            "upbeat": "upbeat dance pop, catchy melody, four on the floor beat, disco vibes, party anthem, energetic and fun, radio ready",
-            
-            "inspiring": "inspiring motivational music, uplifting piano, soaring strings, hopeful melody, achievement and success, emotional build up, major key",
-            
-            "cinematic": "cinematic film score, sweeping orchestra, emotional strings, grand piano, movie soundtrack, epic and beautiful, professional production",
-            
-            "electronic": "modern electronic music, pulsing synth bass, digital drums, futuristic sound design, club banger, energetic drops, progressive house",
-            
-            "hip-hop": "hip hop instrumental beat, 808 bass, trap drums, rolling hi hats, dark melody, modern rap beat, hard hitting, 140 BPM",
-            
-            "lofi": "lofi beats to study to, jazzy samples, dusty drums, warm vinyl sound, relaxing hip hop, chill vibes, perfect loop, 70 BPM",
-            
-            "rock": "energetic rock music, electric guitars, driving bass, powerful drums, anthemic chorus, stadium rock energy, distorted guitars"
-        }
-        
-        return prompts.get(style, f"{style} instrumental music, professional production, no vocals, modern high quality")
+        return _PROMPTS.get(style) or f"{style} instrumental music, professional production, no vocals, modern high quality"
     
     @staticmethod
     def get_available_styles():
-        """Return list of available music styles"""
-        return [
-            "energetic", "epic", "ambient", "happy", "chill",
-            "dramatic", "upbeat", "inspiring", "cinematic",
-            "electronic", "hip-hop", "lofi", "rock"
-        ]
+        """Return available music styles"""
+        return _STYLES
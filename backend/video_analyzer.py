@@ -1,7 +1,333 @@
 """Video analysis for detecting transitions and pacing"""
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# OpenCV's own thread pool does the parallel work; keep OpenMP/BLAS users
+# such as NumPy single-threaded so the two don't oversubscribe the CPUs.
+# main.py sets this before anything imports numpy; this covers importing
+# the module on its own (scripts, spawned analysis workers), and only takes
+# effect if numpy has not been loaded yet.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
 import cv2
 import numpy as np
-from typing import List, Dict, Tuple
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import av
+except ImportError:  # PyAV is optional; OpenCV decodes everything without it
+    av = None
+
+
+# CPUs this process may run on (os.cpu_count() reports every host CPU,
+# including ones a container or taskset excludes)
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+cv2.setNumThreads(CPU_COUNT)
+
+
+# Videos at least this long (seconds) are analyzed from keyframes only
+KEYFRAME_ONLY_MIN_DURATION = 600
+
+# Videos at least this long (seconds) are split across worker processes.
+# Every range pays a capture open and a seek that decodes up to a GOP, and
+# OpenCV already spreads each frame over all CPUs, so shorter clips are
+# faster in a single pass.
+PARALLEL_MIN_DURATION = 120
+
+# Opt-in OpenCL offload of frame scoring (T-API). CPU-only OpenCL runtimes
+# are usually slower than the plain path, so this is left off by default.
+# When on, sampled frames are decoded with OpenCV even if PyAV is installed.
+USE_OPENCL = os.getenv("VIDEO_ANALYSIS_OPENCL", "0") == "1" and cv2.ocl.haveOpenCL()
+
+
+def _open_capture(video_path: str):
+    """Open a capture on the FFmpeg backend, using hardware decoding when available"""
+    params = []
+    if hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):  # OpenCV >= 4.5.2
+        params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, params)
+    if not cap.isOpened():
+        # Let OpenCV pick another backend
+        cap = cv2.VideoCapture(video_path)
+    return cap
+
+
+# Marks the end of the decoded frame stream
+_END_OF_STREAM = object()
+
+
+def _iter_sampled_frames(cap, sample_rate: int, start_frame: int = 0, end_frame: Optional[int] = None, queue_size: int = 4):
+    """
+    Yield (frame_idx, frame) for every sample_rate-th frame of a capture
+    
+    The capture must already be positioned at start_frame; reading stops
+    before end_frame (or at the end of the video). Decoding happens on a
+    background thread feeding a bounded queue, so it overlaps with whatever
+    the caller does with each frame.
+    """
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    
+    def produce():
+        frame_idx = start_frame
+        try:
+            # grab() still decodes every frame; only sampled ones pay for the
+            # BGR conversion and copy in retrieve()
+            while not stop.is_set() and (end_frame is None or frame_idx < end_frame) and cap.grab():
+                if frame_idx % sample_rate == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    frames.put((frame_idx, frame))
+                frame_idx += 1
+        finally:
+            frames.put(_END_OF_STREAM)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (item := frames.get()) is not _END_OF_STREAM:
+            yield item
+    finally:
+        # Unblock the producer if the consumer stopped early
+        stop.set()
+        while producer.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+
+def _sampled_frame_scores(cap, fps: float, sample_rate: int, start_frame: int = 0, end_frame: Optional[int] = None):
+    """
+    Yield (timestamp, diff_score) for every sample_rate-th frame of a capture
+    
+    diff_score is the mean absolute difference (0-255) between consecutive
+    sampled frames after downscaling to 320x240 and grayscale conversion.
+    """
+    # Two preallocated 320x240 buffers: the current frame is written into one
+    # while the other holds the previous frame, then they swap roles
+    current = np.empty((240, 320), dtype=np.uint8)
+    previous = np.empty_like(current)
+    has_previous = False
+    small = np.empty((240, 320, 3), dtype=np.uint8)  # Reused downscaled BGR buffer
+    previous_u = None  # Previous downscaled frame on the OpenCL device
+    
+    for frame_idx, frame in _iter_sampled_frames(cap, sample_rate, start_frame, end_frame):
+        if USE_OPENCL:
+            # Same pipeline as below, with the full-size frame uploaded once
+            # and everything after that running on the device
+            small_u = cv2.resize(cv2.UMat(frame), (320, 240))
+            current_u = cv2.cvtColor(small_u, cv2.COLOR_BGR2GRAY)
+            if previous_u is not None:
+                diff_score = cv2.norm(current_u, previous_u, cv2.NORM_L1) / current.size
+            previous_u = current_u
+        else:
+            # Downscale first so the grayscale conversion only touches
+            # 320x240 pixels instead of the full frame
+            cv2.resize(frame, (320, 240), dst=small)
+            cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=current)
+            
+            if has_previous:
+                # Mean absolute frame difference
+                # (NORM_L1 fuses abs-diff and sum without a diff buffer)
+                diff_score = cv2.norm(current, previous, cv2.NORM_L1) / current.size
+        
+        # The first sampled frame has nothing to compare against
+        if has_previous:
+            yield frame_idx / fps, diff_score
+        
+        current, previous = previous, current
+        has_previous = True
+
+
+def _decode_until_error(container, stream):
+    """
+    Yield decoded frames, ending quietly at the first undecodable packet
+    
+    PyAV raises on damaged or truncated input, whereas cap.grab() simply
+    returns False; stopping here keeps whatever was scored up to that point.
+    """
+    frames = container.decode(stream)
+    while True:
+        try:
+            frame = next(frames)
+        except StopIteration:
+            return
+        except av.error.FFmpegError:
+            return
+        yield frame
+
+
+# 8-bit pixel formats whose first plane is full-resolution luma
+_LUMA_PLANE_FORMATS = frozenset({
+    "yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "nv12", "nv21", "gray"
+})
+
+
+def _av_frame_scores(video_path: str, fps: float, sample_rate: int):
+    """
+    Yield (timestamp, diff_score) for every sample_rate-th frame, decoded with PyAV
+    
+    Same scores as _sampled_frame_scores, but read straight from the
+    decoder's luma plane, which skips the BGR conversion and the grayscale
+    pass. Limited-range luma (16-235) is rescaled to full range so the scene
+    and pace thresholds keep their meaning.
+    """
+    current = np.empty((240, 320), dtype=np.uint8)
+    previous = np.empty_like(current)
+    has_previous = False
+    
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        
+        for frame_idx, frame in enumerate(_decode_until_error(container, stream)):
+            if frame_idx % sample_rate:
+                continue
+            
+            format_name = frame.format.name
+            if format_name in _LUMA_PLANE_FORMATS:
+                # View of the Y plane; rows are padded to line_size bytes
+                plane = frame.planes[0]
+                luma = np.frombuffer(plane, np.uint8).reshape(frame.height, plane.line_size)[:, :frame.width]
+                full_range = format_name.startswith("yuvj") or format_name == "gray" or getattr(frame, "color_range", 0) == 2  # AVCOL_RANGE_JPEG
+            else:
+                luma = frame.reformat(format="gray").to_ndarray()
+                full_range = True
+            cv2.resize(luma, (320, 240), dst=current)
+            
+            if has_previous:
+                diff_score = cv2.norm(current, previous, cv2.NORM_L1) / current.size
+                if not full_range:
+                    diff_score *= 255 / 219
+                yield frame_idx / fps, diff_score
+            
+            current, previous = previous, current
+            has_previous = True
+
+
+def _analyze_range(video_path: str, start_frame: int, end_frame: Optional[int], sample_rate: int) -> List[Tuple[float, float]]:
+    """
+    Score sampled frames in [start_frame, end_frame) with a capture of its own
+    
+    Runs in a worker process, so results are returned as a list.
+    """
+    cap = _open_capture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        # Start one sample early so the first frame of the range has a
+        # predecessor to be compared against
+        seed_frame = max(0, start_frame - sample_rate)
+        if seed_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, seed_frame)
+        return list(_sampled_frame_scores(cap, fps, sample_rate, seed_frame, end_frame))
+    finally:
+        cap.release()
+
+
+def _init_worker():
+    """Run OpenCV single-threaded in pool workers; the pool already uses every CPU"""
+    cv2.setNumThreads(1)
+
+
+# One pool shared by all requests, so concurrent analyses queue for the same
+# CPU_COUNT workers instead of each starting its own. Workers are spawned on
+# first use and kept alive, so their start-up cost is paid once.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Return the shared analysis process pool, creating it if needed"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn avoids forking a process that has other request threads running
+            _pool = ProcessPoolExecutor(
+                max_workers=CPU_COUNT,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Drop a broken pool so the next analysis creates a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def _parallel_frame_scores(video_path: str, frame_count: int, sample_rate: int, workers: int):
+    """Yield (timestamp, diff_score) in order, analyzing contiguous frame ranges in parallel"""
+    # Range size rounded up to the sampling grid so every range samples the
+    # same frames a single pass would
+    range_size = -(-frame_count // workers)
+    range_size += -range_size % sample_rate
+    starts = list(range(0, frame_count, range_size))
+    ranges = [(start, start + range_size) for start in starts[:-1]] + [(starts[-1], None)]
+    
+    executor = _get_pool()
+    futures = [
+        executor.submit(_analyze_range, video_path, start, end, sample_rate)
+        for start, end in ranges
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start fresh next time
+        _reset_pool(executor)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _is_constant_frame_rate(video_path: str) -> bool:
+    """Check whether a video's average frame rate matches its nominal rate"""
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            return stream.average_rate is not None and stream.average_rate == stream.base_rate
+    except av.error.FFmpegError:
+        # PyAV can't read it; let the OpenCV paths handle the file
+        return False
+
+
+def _keyframe_scores(video_path: str):
+    """
+    Yield (timestamp, diff_score) between consecutive keyframes
+    
+    Only keyframes are decoded, which is much cheaper for long videos since
+    encoders place keyframes at most scene cuts. Keyframes are far apart, so
+    motion scores are coarser than with regular frame sampling.
+    """
+    prev_frame = None
+    
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        
+        for frame in _decode_until_error(container, stream):
+            small = frame.reformat(width=320, height=240, format="gray").to_ndarray()
+            
+            if prev_frame is not None:
+                diff_score = cv2.norm(small, prev_frame, cv2.NORM_L1) / small.size
+                yield float(frame.time), diff_score
+            
+            prev_frame = small
 
 
 class VideoAnalyzer:
@@ -16,53 +342,54 @@ class VideoAnalyzer:
         - scene_changes: timestamps of major transitions
         - intensity_profile: motion intensity over time
         - overall_pace: slow/medium/fast
+        
+        This blocks and already parallelizes internally (OpenCV threads or
+        worker processes). From async code, run it on a single worker thread
+        (run_blocking in main.py); wrapping it in further thread pools only
+        adds contention.
         """
-        cap = cv2.VideoCapture(video_path)
+        cap = _open_capture(video_path)
         
         fps = cap.get(cv2.CAP_PROP_FPS)
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         duration = frame_count / fps if fps > 0 else 0
         
         scene_changes = []
-        motion_scores = []
-        prev_frame = None
-        frame_idx = 0
+        motion_sum = 0.0
+        motion_count = 0
         
-        # Sample frames (analyze every 5th frame for performance)
-        sample_rate = 5
+        if av is not None and duration >= KEYFRAME_ONLY_MIN_DURATION and _is_constant_frame_rate(video_path):
+            # Long video: approximate by comparing consecutive keyframes
+            cap.release()
+            scores = _keyframe_scores(video_path)
+        elif duration >= PARALLEL_MIN_DURATION and CPU_COUNT > 1:
+            # Longer clip: split into one frame range per CPU
+            cap.release()
+            scores = _parallel_frame_scores(video_path, frame_count, sample_rate=5, workers=CPU_COUNT)
+        elif av is not None and not USE_OPENCL and cap.isOpened():
+            # Sample frames (every 5th for performance), reading luma directly.
+            # The OpenCL path needs BGR frames, so PyAV is skipped when it's on.
+            cap.release()
+            scores = _av_frame_scores(video_path, fps, sample_rate=5)
+        else:
+            # Sample frames (analyze every 5th frame for performance)
+            scores = _sampled_frame_scores(cap, fps, sample_rate=5)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        for timestamp, diff_score in scores:
+            # High difference = scene change or high motion
+            motion_sum += diff_score
+            motion_count += 1
             
-            if frame_idx % sample_rate == 0:
-                # Convert to grayscale and resize for faster processing
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                gray = cv2.resize(gray, (320, 240))
-                
-                if prev_frame is not None:
-                    # Detect scene changes using frame difference
-                    diff = cv2.absdiff(gray, prev_frame)
-                    diff_score = np.mean(diff)
-                    
-                    # High difference = scene change or high motion
-                    motion_scores.append(diff_score)
-                    
-                    # Detect significant scene changes
-                    if diff_score > 30:  # Threshold for scene change
-                        timestamp = frame_idx / fps
-                        scene_changes.append(timestamp)
-                
-                prev_frame = gray.copy()
-            
-            frame_idx += 1
+            # Detect significant scene changes
+            if diff_score > 30:  # Threshold for scene change
+                scene_changes.append(timestamp)
         
         cap.release()
         
         # Calculate overall pace based on motion
-        if motion_scores:
-            avg_motion = np.mean(motion_scores)
+        avg_motion = 0.0
+        if motion_count:
+            avg_motion = motion_sum / motion_count
             if avg_motion > 25:
                 pace = "fast"
             elif avg_motion > 15:
@@ -72,11 +399,16 @@ class VideoAnalyzer:
         else:
             pace = "medium"
         
-        # Remove duplicate scene changes (within 1 second)
+        # Remove duplicate scene changes (within 1 second of the last kept one).
+        # Jump straight to the next candidate with a binary search instead of
+        # visiting every detection.
+        changes = np.asarray(scene_changes, dtype=np.float64)
         filtered_changes = []
-        for timestamp in scene_changes:
-            if not filtered_changes or timestamp - filtered_changes[-1] > 1.0:
-                filtered_changes.append(timestamp)
+        idx = 0
+        while idx < changes.size:
+            timestamp = float(changes[idx])
+            filtered_changes.append(timestamp)
+            idx = int(np.searchsorted(changes, timestamp + 1.0, side="right"))
         
         return {
             "duration": duration,
@@ -98,35 +430,44 @@ class VideoAnalyzer:
         Returns:
             Detailed prompt for AI music generation
         """
-        pace = analysis["overall_pace"]
-        intensity = analysis["motion_intensity"]
         num_scenes = analysis["num_scenes"]
         
-        # Build dynamic prompt based on video characteristics
-        tempo_map = {
-            "slow": "slow tempo, calm",
-            "medium": "moderate tempo",
-            "fast": "fast tempo, energetic"
-        }
-        
-        intensity_map = {
-            "low": "gentle, subtle",
-            "medium": "balanced, moderate energy",
-            "high": "intense, powerful"
-        }
-        
         # Dynamic structure based on scenes
         if num_scenes > 5:
-            structure = "dynamic with build-ups and transitions"
+            structure = "dynamic"
         elif num_scenes > 2:
-            structure = "with some variation and progression"
+            structure = "varied"
         else:
-            structure = "steady and consistent"
+            structure = "steady"
         
-        prompt = (
-            f"{style} instrumental music, {tempo_map[pace]}, "
-            f"{intensity_map[intensity]}, {structure}, "
-            f"professional production, no vocals, cinematic"
-        )
-        
-        return prompt
+        return _build_music_prompt(style, analysis["overall_pace"], analysis["motion_intensity"], structure)
+
+
+# Prompt fragments keyed by video characteristics
+_TEMPO_MAP = {
+    "slow": "slow tempo, calm",
+    "medium": "moderate tempo",
+    "fast": "fast tempo, energetic"
+}
+
+_INTENSITY_MAP = {
+    "low": "gentle, subtle",
+    "medium": "balanced, moderate energy",
+    "high": "intense, powerful"
+}
+
+_STRUCTURE_MAP = {
+    "dynamic": "dynamic with build-ups and transitions",
+    "varied": "with some variation and progression",
+    "steady": "steady and consistent"
+}
+
+
+@lru_cache(maxsize=256)
+def _build_music_prompt(style: str, pace: str, intensity: str, structure: str) -> str:
+    """Assemble a prompt; only a few hundred combinations exist, so results are cached"""
+    return (
+        f"{style} instrumental music, {_TEMPO_MAP[pace]}, "
+        f"{_INTENSITY_MAP[intensity]}, {_STRUCTURE_MAP[structure]}, "
+        f"professional production, no vocals, cinematic"
+    )
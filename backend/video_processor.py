@@ -1,8 +1,51 @@
 """Video processing utilities using FFmpeg"""
 import ffmpeg
 import os
+import struct
+import threading
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+
+# Audio codecs that can be stream-copied out of a video, and the container
+# extension each one is written to
+_COPYABLE_AUDIO = {
+    "aac": ".m4a",
+    "mp3": ".mp3"
+}
+
+
+# ffprobe results keyed by (real path, mtime, size), so a file that is
+# replaced or modified is probed again
+_PROBE_CACHE: Dict[Tuple[str, int, int], Dict] = {}
+_PROBE_CACHE_MAX_ENTRIES = 256
+_PROBE_CACHE_LOCK = threading.Lock()
+
+
+def _probe(path: str) -> Dict:
+    """ffmpeg.probe with results cached per file version"""
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    with _PROBE_CACHE_LOCK:
+        cached = _PROBE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    
+    # Probe outside the lock so slow files don't block other lookups
+    probe = ffmpeg.probe(path)
+    with _PROBE_CACHE_LOCK:
+        if len(_PROBE_CACHE) >= _PROBE_CACHE_MAX_ENTRIES:
+            # Drop the oldest entry
+            del _PROBE_CACHE[next(iter(_PROBE_CACHE))]
+        _PROBE_CACHE[key] = probe
+    return probe
+
+
+def _audio_codec(path: str) -> Optional[str]:
+    """Codec name of the first audio stream, or None if there is none"""
+    for stream in _probe(path)['streams']:
+        if stream['codec_type'] == 'audio':
+            return stream.get('codec_name')
+    return None
 
 
 class VideoProcessor:
@@ -20,24 +63,100 @@ class VideoProcessor:
             Dictionary with video metadata
         """
         try:
-            probe = ffmpeg.probe(video_path)
-            video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+            probe = _probe(video_path)
+            video_info = None
+            has_audio = False
+            for stream in probe['streams']:
+                if stream['codec_type'] == 'video' and video_info is None:
+                    video_info = stream
+                elif stream['codec_type'] == 'audio':
+                    has_audio = True
+            if video_info is None:
+                raise ValueError("no video stream")
             
             duration = float(probe['format']['duration'])
             width = int(video_info['width'])
             height = int(video_info['height'])
-            fps = eval(video_info['r_frame_rate'])  # Convert "30/1" to 30.0
+            # Convert "30/1" to 30.0; ffprobe reports "0/0" when unknown
+            num, den = video_info['r_frame_rate'].split('/')
+            fps = int(num) / int(den) if int(den) else 0.0
             
             return {
                 "duration": duration,
                 "width": width,
                 "height": height,
                 "fps": fps,
-                "has_audio": any(s['codec_type'] == 'audio' for s in probe['streams'])
+                "has_audio": has_audio
             }
         except Exception as e:
             raise Exception(f"Failed to get video info: {str(e)}")
     
+    @staticmethod
+    def get_video_duration(video_path: str) -> float:
+        """
+        Get video duration in seconds as cheaply as possible
+        
+        MP4/MOV files are read from the movie header atom, which only touches
+        a few KB; other containers fall back to ffprobe.
+        
+        Args:
+            video_path: Path to the video file
+            
+        Returns:
+            Duration in seconds
+        """
+        if Path(video_path).suffix.lower() in (".mp4", ".mov"):
+            duration = VideoProcessor._read_mp4_duration(video_path)
+            if duration:
+                return duration
+        return VideoProcessor.get_video_info(video_path)["duration"]
+    
+    @staticmethod
+    def _read_mp4_duration(video_path: str) -> Optional[float]:
+        """
+        Read duration from the mvhd atom of an MP4/MOV file
+        
+        Returns:
+            Duration in seconds, or None if it can't be determined
+        """
+        try:
+            with open(video_path, "rb") as f:
+                file_size = os.fstat(f.fileno()).st_size
+                end = file_size
+                pos = 0
+                
+                # Walk atom headers, descending into moov to find mvhd
+                while pos + 8 <= end:
+                    f.seek(pos)
+                    size, kind = struct.unpack(">I4s", f.read(8))
+                    header = 8
+                    if size == 1:
+                        size = struct.unpack(">Q", f.read(8))[0]
+                        header = 16
+                    elif size == 0:
+                        size = end - pos
+                    if size < header:
+                        return None
+                    
+                    if kind == b"moov":
+                        end = pos + size
+                        pos += header
+                        continue
+                    
+                    if kind == b"mvhd":
+                        version = f.read(1)[0]
+                        f.seek(3, os.SEEK_CUR)  # flags
+                        if version == 1:
+                            _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                        else:
+                            _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                        return duration / timescale if timescale and duration else None
+                    
+                    pos += size
+        except (OSError, struct.error, IndexError):
+            pass
+        return None
+    
     @staticmethod
     def merge_audio_video(
         video_path: str,
@@ -61,16 +180,27 @@ class VideoProcessor:
             video = ffmpeg.input(video_path)
             audio = ffmpeg.input(audio_path)
             
+            # Let MP4/MOV playback start before the whole file is downloaded
+            container_args = {}
+            if Path(output_path).suffix.lower() in ('.mp4', '.mov', '.m4v'):
+                container_args['movflags'] = '+faststart'
+            
             if remove_original_audio:
+                # Music that is already AAC can be copied as-is
+                if _audio_codec(audio_path) == 'aac':
+                    audio_args = {'acodec': 'copy'}
+                else:
+                    audio_args = {'acodec': 'aac', 'audio_bitrate': '192k'}  # Use AAC audio codec
+                
                 # Use only the new audio
                 output = ffmpeg.output(
                     video.video,
                     audio.audio,
                     output_path,
                     vcodec='copy',  # Don't re-encode video (faster)
-                    acodec='aac',   # Use AAC audio codec
-                    audio_bitrate='192k',
-                    shortest=None   # Cut to shortest stream (video or audio)
+                    shortest=None,  # Cut to shortest stream (video or audio)
+                    **audio_args,
+                    **container_args
                 )
             else:
                 # Mix original audio with new audio
@@ -80,14 +210,15 @@ class VideoProcessor:
                     output_path,
                     vcodec='copy',
                     acodec='aac',
-                    audio_bitrate='192k'
+                    audio_bitrate='192k',
+                    **container_args
                 )
             
             # Overwrite output file if it exists
             output = ffmpeg.overwrite_output(output)
             
             # Run the ffmpeg command
-            ffmpeg.run(output, capture_stdout=True, capture_stderr=True)
+            ffmpeg.run(output, capture_stderr=True)
             
             return output_path
             
@@ -102,6 +233,10 @@ class VideoProcessor:
         """
         Extract audio from video file
         
+        AAC and MP3 tracks are copied without re-encoding, in which case the
+        output extension is changed to one that can hold the codec. Other
+        codecs are encoded to MP3 at output_path.
+        
         Args:
             video_path: Path to video file
             output_path: Path for extracted audio
@@ -110,11 +245,61 @@ class VideoProcessor:
             Path to extracted audio file
         """
         try:
-            stream = ffmpeg.input(video_path)
-            audio = stream.audio
-            output = ffmpeg.output(audio, output_path, acodec='mp3', audio_bitrate='192k')
+            codec = _audio_codec(video_path)
+            
+            audio = ffmpeg.input(video_path).audio
+            if codec in _COPYABLE_AUDIO:
+                output_path = str(Path(output_path).with_suffix(_COPYABLE_AUDIO[codec]))
+                output = ffmpeg.output(audio, output_path, acodec='copy')
+            else:
+                output = ffmpeg.output(audio, output_path, acodec='mp3', audio_bitrate='192k')
             output = ffmpeg.overwrite_output(output)
-            ffmpeg.run(output, capture_stdout=True, capture_stderr=True)
+            ffmpeg.run(output, capture_stderr=True)
             return output_path
         except Exception as e:
             raise Exception(f"Failed to extract audio: {str(e)}")
+    
+    @staticmethod
+    def extract_frames_at(video_path: str, timestamps: List[float], output_pattern: str) -> List[str]:
+        """
+        Extract one frame per timestamp with a single FFmpeg run
+        
+        Args:
+            video_path: Path to video file
+            timestamps: Times in seconds, e.g. scene_changes from VideoAnalyzer
+            output_pattern: Numbered image path such as "thumbs/scene_%03d.jpg"
+            
+        Returns:
+            Paths of the extracted frames, in timestamp order. Timestamps that
+            land on the same frame share one image, so the list can be
+            shorter than timestamps.
+        """
+        # float() also turns numpy scalars into plain numbers for the expression
+        times = sorted({float(t) for t in timestamps})
+        if not times:
+            return []
+        
+        # At most one image per timestamp is written; clear leftovers from an
+        # earlier run with the same pattern so they aren't reported as ours
+        frames = [output_pattern % (i + 1) for i in range(len(times))]
+        for frame in frames:
+            if os.path.exists(frame):
+                os.remove(frame)
+        
+        # Pick the first frame at or after each timestamp; exact eq(t,T) would
+        # miss timestamps that fall between frames
+        conditions = [
+            f"gte(t,{t})*(isnan(prev_pts)+lt(prev_pts*TB,{t}))"
+            for t in times
+        ]
+        
+        try:
+            stream = ffmpeg.input(video_path).video.filter("select", "+".join(conditions))
+            output = ffmpeg.output(stream, output_pattern, vsync="vfr")
+            output = ffmpeg.overwrite_output(output)
+            ffmpeg.run(output, capture_stderr=True)
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode() if e.stderr else str(e)
+            raise Exception(f"FFmpeg error: {error_message}")
+        
+        return [frame for frame in frames if os.path.exists(frame)]